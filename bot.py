@@ -2,23 +2,44 @@
 """
 Telegram menfess (trimmed) — with startup channel check and channel-send fallback.
 """
-import atexit
 import asyncio
 import logging
 import os
 import re
-import sqlite3
 import time
+import weakref
+from collections import deque
+from contextlib import asynccontextmanager
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, Optional, Tuple, Union
+from typing import Deque, Optional, Set, Tuple
 
 from html import escape as escape_html
-import requests
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+try:
+    import orjson
+except ImportError:
+    orjson = None
+import aiosqlite
+from cachetools import LRUCache, TTLCache
 
 from telegram import Message, Update
-from telegram.constants import ParseMode
-from telegram.error import BadRequest
-from telegram.ext import Application, CommandHandler, ContextTypes, MessageHandler, filters
+from telegram.constants import ChatType, MessageEntityType, ParseMode
+from telegram.error import BadRequest, RetryAfter, TimedOut
+from telegram.request import HTTPXRequest
+from telegram.ext import (
+    Application,
+    ApplicationHandlerStop,
+    CommandHandler,
+    ContextTypes,
+    MessageHandler,
+    TypeHandler,
+    filters,
+)
 
 # ---------------------------
 # CONFIG / LOCK
@@ -26,20 +47,24 @@ from telegram.ext import Application, CommandHandler, ContextTypes, MessageHandl
 DATA_DIR = os.getenv("DATA_DIR", "/app/data")
 os.makedirs(DATA_DIR, exist_ok=True)
 LOCK_FILE = os.path.join(DATA_DIR, "bot.lock")
-if os.path.exists(LOCK_FILE):
+# the kernel drops the flock when the process dies, so a crash never leaves a stale lock
+LOCK_FD = os.open(LOCK_FILE, os.O_CREAT | os.O_RDWR, 0o644)
+try:
+    if fcntl is not None:
+        fcntl.flock(LOCK_FD, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    else:
+        msvcrt.locking(LOCK_FD, msvcrt.LK_NBLCK, 1)
+except OSError:
     print("❌ Bot already running (lock file detected). Exiting.")
     raise SystemExit(0)
-with open(LOCK_FILE, "w") as f:
-    f.write(str(os.getpid()))
-def cleanup_lock():
-    try:
-        if os.path.exists(LOCK_FILE):
-            os.remove(LOCK_FILE)
-    except Exception:
-        pass
-atexit.register(cleanup_lock)
+os.ftruncate(LOCK_FD, 0)
+os.write(LOCK_FD, str(os.getpid()).encode())
 
 logging.basicConfig(level=logging.INFO)
+# the format never prints thread/process info, so skip collecting it per record
+logging.logThreads = False
+logging.logProcesses = False
+logging.logMultiprocessing = False
 logger = logging.getLogger(__name__)
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
@@ -48,11 +73,18 @@ if not BOT_TOKEN:
     raise SystemExit(1)
 
 OWNER_ID = int(os.getenv("OWNER_ID", "0"))
+# extra bot admins (comma-separated user ids); the owner is always one
+ADMIN_IDS = frozenset({OWNER_ID} | {int(x) for x in os.getenv("ADMIN_IDS", "").split(",") if x.strip()})
 # MUST set CHANNEL_ID and LOG_CHANNEL_ID correctly (use -100... for channels)
 CHANNEL_ID = int(os.getenv("CHANNEL_ID", "0"))
 LOG_CHANNEL_ID = int(os.getenv("LOG_CHANNEL_ID", "0"))
+# set WEBHOOK_URL (public https base) to receive updates via webhook instead of polling
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or None
+PORT = int(os.getenv("PORT", "8443"))
 
-TAGS = ["#pria", "#wanita"]
+TAG_RE = re.compile(r"#(pria|wanita)\b", re.IGNORECASE)
+TAG_SEARCH = TAG_RE.search
 MAX_PHOTO_VIDEO_PER_DAY = int(os.getenv("LIMIT_MENFESS_MEDIA", "10"))
 MAX_TEXT_PER_DAY = int(os.getenv("LIMIT_MENFESS_TEXT", "5"))
 TELEGRAM_MAX_BYTES = 50 * 1024 * 1024
@@ -68,15 +100,56 @@ try:
         os.makedirs(db_dir, exist_ok=True)
 except Exception:
     DB_PATH = ":memory:"
-try:
-    db = sqlite3.connect(DB_PATH, check_same_thread=False)
-    db.execute("PRAGMA journal_mode=WAL;")
-except Exception:
-    db = sqlite3.connect(":memory:", check_same_thread=False)
-db.row_factory = sqlite3.Row
-_db_lock = asyncio.Lock()
-with db:
-    db.execute(
+DB_READERS = int(os.getenv("DB_READERS", "4"))
+WAL_CHECKPOINT_INTERVAL = 300
+DB_OPTIMIZE_INTERVAL = 900
+
+# one dedicated writer + N readers (WAL lets readers run alongside the writer);
+# both are filled in init_db() once the event loop is running
+_db_writer: "asyncio.Queue[aiosqlite.Connection]" = asyncio.Queue()
+_db_readers: "asyncio.Queue[aiosqlite.Connection]" = asyncio.Queue()
+_db_conns = []
+
+# per-connection settings, applied every time a pooled connection is opened
+CONN_PRAGMAS = """
+PRAGMA synchronous=NORMAL;
+PRAGMA busy_timeout=30000;
+PRAGMA temp_store=MEMORY;
+PRAGMA cache_size=-65536;
+PRAGMA mmap_size=268435456;
+PRAGMA wal_autocheckpoint=1000;
+PRAGMA foreign_keys=ON;
+"""
+
+async def _open_db_conn(path: str, readonly: bool = False) -> aiosqlite.Connection:
+    if readonly:
+        # readers can never take the write lock by accident; the writer already set WAL
+        conn = await aiosqlite.connect(f"{Path(path).resolve().as_uri()}?mode=ro", uri=True)
+    else:
+        conn = await aiosqlite.connect(path)
+        # must come before journal_mode, which writes the header of a new file
+        await conn.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+        await conn.execute("PRAGMA journal_mode=WAL;")
+    await conn.executescript(CONN_PRAGMAS)
+    return conn
+
+async def init_db(app: Optional[Application] = None):
+    global DB_PATH, _db_readers
+    try:
+        writer = await _open_db_conn(DB_PATH)
+    except Exception:
+        logger.exception("Could not open %s, falling back to in-memory DB", DB_PATH)
+        DB_PATH = ":memory:"
+        writer = await _open_db_conn(DB_PATH)
+    _db_conns.append(writer)
+    async with writer.execute("PRAGMA auto_vacuum;") as cur:
+        (auto_vacuum,) = await cur.fetchone()
+    if auto_vacuum != 2:
+        # files created before auto_vacuum was set need a one-off rebuild to switch
+        logger.info("Converting %s to incremental auto_vacuum", DB_PATH)
+        await writer.execute("VACUUM;")
+    # users is only ever reached by user_id (the gender upsert), so it has no secondary index
+    await writer.execute(
         """
     CREATE TABLE IF NOT EXISTS users (
         user_id INTEGER PRIMARY KEY,
@@ -85,7 +158,9 @@ with db:
     )
     """
     )
-    db.execute(
+    # the (user_id, chat_id) primary key serves the INSERT OR IGNORE on join; nothing
+    # looks rows up by chat_id alone, so a (chat_id, user_id) index would only slow inserts
+    await writer.execute(
         """
     CREATE TABLE IF NOT EXISTS welcomed_users (
         user_id INTEGER,
@@ -94,79 +169,268 @@ with db:
     )
     """
     )
+    # accepted posts of the last 24h, so quotas survive a restart
+    await writer.execute(
+        """
+    CREATE TABLE IF NOT EXISTS post_log (
+        user_id INTEGER,
+        kind TEXT,
+        ts REAL
+    )
+    """
+    )
+    await writer.execute("CREATE INDEX IF NOT EXISTS idx_post_log_ts ON post_log(ts)")
+    await writer.commit()
+    async with writer.execute("SELECT 1 FROM sqlite_master WHERE name='sqlite_stat1'") as cur:
+        analyzed = await cur.fetchone()
+    # full ANALYZE once so the planner has stats for the indexes; cheap optimize afterwards
+    await writer.execute("PRAGMA optimize;" if analyzed else "ANALYZE;")
+    await writer.commit()
+    _db_writer.put_nowait(writer)
+    if DB_PATH == ":memory:":
+        # every :memory: connection is its own database, so readers share the writer
+        _db_readers = _db_writer
+        return
+    if app is not None and app.job_queue is not None:
+        app.job_queue.run_repeating(wal_checkpoint, interval=WAL_CHECKPOINT_INTERVAL, first=60)
+        app.job_queue.run_repeating(db_optimize, interval=DB_OPTIMIZE_INTERVAL, first=DB_OPTIMIZE_INTERVAL)
+    else:
+        logger.warning("JobQueue unavailable; relying on SQLite auto-checkpoints")
+    for _ in range(max(DB_READERS, 1)):
+        conn = await _open_db_conn(DB_PATH, readonly=True)
+        _db_conns.append(conn)
+        _db_readers.put_nowait(conn)
+
+async def wal_checkpoint(context: ContextTypes.DEFAULT_TYPE):
+    try:
+        async with acquire(write=True) as conn:
+            async with conn.execute("PRAGMA wal_checkpoint(PASSIVE);") as cur:
+                busy, wal_pages, checkpointed = await cur.fetchone()
+            # executescript steps the pragma to completion; execute() frees one page
+            await conn.executescript("PRAGMA incremental_vacuum;")
+        logger.debug("WAL checkpoint: busy=%s wal_pages=%s checkpointed=%s", busy, wal_pages, checkpointed)
+    except Exception:
+        logger.exception("WAL checkpoint failed")
+
+async def db_optimize(context: ContextTypes.DEFAULT_TYPE):
+    try:
+        async with acquire(write=True) as conn:
+            await conn.execute("PRAGMA optimize;")
+    except Exception:
+        logger.exception("PRAGMA optimize failed")
+
+async def close_db(app: Optional[Application] = None):
+    while _db_conns:
+        conn = _db_conns.pop()
+        try:
+            await conn.close()
+        except Exception:
+            logger.exception("Failed to close DB connection")
+
+@asynccontextmanager
+async def acquire(write: bool = False):
+    """Borrow a pooled connection; the writer queue holds a single connection."""
+    pool = _db_writer if write else _db_readers
+    conn = await pool.get()
+    try:
+        yield conn
+    finally:
+        pool.put_nowait(conn)
 
 # ---------------------------
 # In-memory counters / helpers
 # ---------------------------
-USER_POST_STATS: Dict[int, Dict[str, Union[int, float]]] = {}
-
-def human_time(seconds: int) -> str:
-    h = seconds // 3600
-    m = (seconds % 3600) // 60
+# monotonic: immune to wall-clock steps; wall time is only for Telegram's until_date
+# and the persisted post_log
+_now = time.monotonic
+
+class PostStats:
+    """Post timestamps of one user inside the rolling 24h window, one deque per kind."""
+
+    __slots__ = ("media", "text")
+
+    def __init__(self):
+        self.media: Deque[float] = deque(maxlen=max(MAX_PHOTO_VIDEO_PER_DAY, 1))
+        self.text: Deque[float] = deque(maxlen=max(MAX_TEXT_PER_DAY, 1))
+
+# user_id -> PostStats; idle users fall out of the TTLCache on their own
+USER_POST_STATS: "TTLCache[int, PostStats]" = TTLCache(maxsize=100_000, ttl=DAILY_SECONDS)
+# user_id -> gender as stored in the users table
+GENDER_CACHE: "LRUCache[int, str]" = LRUCache(maxsize=50_000)
+POST_LIMITS = {"media": MAX_PHOTO_VIDEO_PER_DAY, "text": MAX_TEXT_PER_DAY}
+QUOTA_MSG = {
+    "media": "😅 Kuota kirim foto/video hari ini sudah habis.\n⏳ Reset dalam %s\n",
+    "text": "😅 Kuota kirim teks hari ini sudah habis.\n⏳ Reset dalam %s\n",
+}
+
+# for small-cardinality fields (names, usernames, gender); never for post bodies
+cached_escape = lru_cache(maxsize=10_000)(escape_html)
+
+@lru_cache(maxsize=DAILY_SECONDS // 60)
+def _human_minutes(minutes: int) -> str:
+    h, m = divmod(minutes, 60)
     if h:
         return f"{h} jam {m} menit"
     if m:
         return f"{m} menit"
     return "beberapa detik"
 
-def safe_caption(text: Optional[str], limit: int = 1024) -> Optional[str]:
-    if not text:
-        return None
-    txt = str(text).replace("\x00", "")
-    return txt[:limit] if len(txt) > limit else txt
+def human_time(seconds: int) -> str:
+    # cache on what is displayed (whole minutes): at most 1440 keys within the 24h window
+    return _human_minutes(seconds // 60)
 
-def safe_text_message(text: Optional[str], limit: int = 4096) -> str:
+_NUL_TABLE = str.maketrans("", "", "\x00")
+
+def _safe(text: Optional[str], limit: int) -> str:
+    """Strip NULs and truncate to a Telegram length limit (1024 caption / 4096 text)."""
     if not text:
         return ""
-    txt = str(text).replace("\x00", "")
-    return txt[:limit] if len(txt) > limit else txt
+    if "\x00" in text:
+        text = text.translate(_NUL_TABLE)
+    return text[:limit] if len(text) > limit else text
+
+# ---------------------------
+# Outbound rate limiting (Telegram: ~30 msg/s per bot, ~1 msg/s per chat)
+# ---------------------------
+class TokenBucket:
+    """Async token bucket refilled at `rate` tokens/second, holding at most `burst`."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last = _now()
+
+    def _try_take(self) -> bool:
+        now = _now()
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    def _delay_until_refill(self) -> float:
+        return (1 - self._tokens) / self.rate
+
+    async def acquire(self):
+        while not self._try_take():
+            await asyncio.sleep(self._delay_until_refill())
+
+# every rate-limited Bot API call takes a token here, not just channel sends
+GLOBAL_BUCKET = TokenBucket(25, 25)
+PER_CHAT_BUCKETS: "TTLCache[int, TokenBucket]" = TTLCache(maxsize=10_000, ttl=60)
+
+def _chat_bucket(chat_id: int) -> TokenBucket:
+    bucket = PER_CHAT_BUCKETS.get(chat_id)
+    if bucket is None:
+        bucket = PER_CHAT_BUCKETS[chat_id] = TokenBucket(1, 1)
+    return bucket
+
+async def rate_limited(send, /, chat_id: int, *, per_chat: bool = True, **kwargs):
+    """Call a Bot method within the global and per-chat budgets; retry once on RetryAfter.
+
+    per_chat=False skips the per-chat bucket, for calls that post nothing into the chat
+    (deletes, bans, admin lookups).
+    """
+    await GLOBAL_BUCKET.acquire()
+    if per_chat:
+        await _chat_bucket(chat_id).acquire()
+    try:
+        return await send(chat_id=chat_id, **kwargs)
+    except RetryAfter as e:
+        logger.warning("Flood limit hit for chat %s, retrying in %ss", chat_id, e.retry_after)
+        await asyncio.sleep(e.retry_after)
+        return await send(chat_id=chat_id, **kwargs)
+
+async def reply(msg: Message, text: str, **kwargs):
+    """Rate-limited msg.reply_text(); like PTB, only quotes the message outside private chats."""
+    if msg.chat.type != ChatType.PRIVATE:
+        kwargs.setdefault("reply_to_message_id", msg.message_id)
+    return await rate_limited(msg.get_bot().send_message, chat_id=msg.chat_id, text=text, **kwargs)
+
+# media kind -> (Bot method, file argument, text argument)
+MEDIA_SENDERS = {
+    "photo": ("send_photo", "photo", "caption"),
+    "video": ("send_video", "video", "caption"),
+    "text": ("send_message", None, "text"),
+}
+
+def classify(msg: Message) -> Tuple[str, Optional[str]]:
+    """Return the media kind of a post and the file_id to forward (None for text)."""
+    if msg.photo:
+        return "photo", msg.photo[-1].file_id
+    if msg.video:
+        return "video", msg.video.file_id
+    return "text", None
+
+async def send_media(bot, chat_id: int, kind: str, file_id: Optional[str], text: Optional[str], **kwargs):
+    method, file_arg, text_arg = MEDIA_SENDERS[kind]
+    if file_arg:
+        kwargs[file_arg] = file_id
+    kwargs[text_arg] = text
+    return await rate_limited(getattr(bot, method), chat_id=chat_id, **kwargs)
 
 def is_admin_id(user_id: int) -> bool:
-    return user_id == OWNER_ID
+    return user_id in ADMIN_IDS
 
-def _reset_post_stats_if_needed(stats):
-    now = time.time()
-    first_ts = stats.get("first_ts", 0)
-    if now - first_ts >= DAILY_SECONDS:
-        return {"first_ts": now, "photos_vids": 0, "texts": 0}
-    return stats
+def _expire_posts(dq: Deque[float], now: float):
+    while dq and dq[0] <= now - DAILY_SECONDS:
+        dq.popleft()
 
 def is_post_allowed(user_id: int, kind: str) -> Tuple[bool, int]:
     if is_admin_id(user_id):
         return True, 0
-    now = time.time()
+    limit = POST_LIMITS[kind]
     stats = USER_POST_STATS.get(user_id)
     if not stats:
-        remaining = MAX_PHOTO_VIDEO_PER_DAY if kind == "media" else MAX_TEXT_PER_DAY
-        return True, remaining
-    stats = _reset_post_stats_if_needed(stats)
-    USER_POST_STATS[user_id] = stats
-    if kind == "media":
-        used = stats.get("photos_vids", 0)
-        if used >= MAX_PHOTO_VIDEO_PER_DAY:
-            remaining_seconds = int(DAILY_SECONDS - (now - stats["first_ts"]))
-            return False, remaining_seconds
-        return True, MAX_PHOTO_VIDEO_PER_DAY - used
-    else:
-        used = stats.get("texts", 0)
-        if used >= MAX_TEXT_PER_DAY:
-            remaining_seconds = int(DAILY_SECONDS - (now - stats["first_ts"]))
-            return False, remaining_seconds
-        return True, MAX_TEXT_PER_DAY - used
-
-def increment_post_count(user_id: int, kind: str):
-    now = time.time()
+        return True, limit
+    now = _now()
+    dq = getattr(stats, kind)
+    _expire_posts(dq, now)
+    if dq and len(dq) >= limit:
+        remaining_seconds = int(DAILY_SECONDS - (now - dq[0]))
+        return False, remaining_seconds
+    return True, limit - len(dq)
+
+def increment_post_count(user_id: int, kind: str, now: Optional[float] = None):
+    if now is None:
+        now = _now()
     stats = USER_POST_STATS.get(user_id)
     if not stats:
-        stats = {"first_ts": now, "photos_vids": 0, "texts": 0}
-        USER_POST_STATS[user_id] = stats
-    else:
-        stats = _reset_post_stats_if_needed(stats)
-        USER_POST_STATS[user_id] = stats
-    if kind == "media":
-        stats["photos_vids"] = stats.get("photos_vids", 0) + 1
-    else:
-        stats["texts"] = stats.get("texts", 0) + 1
+        stats = PostStats()
+    dq = getattr(stats, kind)
+    _expire_posts(dq, now)
+    dq.append(now)
+    # re-set so the TTL is measured from the latest post, not the first one
+    USER_POST_STATS[user_id] = stats
+
+async def record_post(user_id: int, kind: str):
+    increment_post_count(user_id, kind)
+    try:
+        async with acquire(write=True) as conn:
+            await conn.execute("INSERT INTO post_log (user_id, kind, ts) VALUES (?, ?, ?)", (user_id, kind, time.time()))
+            await conn.commit()
+    except Exception:
+        logger.exception("Failed to persist post for user %s", user_id)
+
+async def load_post_stats():
+    """Rebuild USER_POST_STATS from post_log after a restart."""
+    wall_now = time.time()
+    # post_log keeps wall-clock times; the in-memory windows run on the monotonic clock
+    offset = _now() - wall_now
+    async with acquire() as conn:
+        async with conn.execute(
+            "SELECT user_id, kind, ts FROM post_log WHERE ts > ? ORDER BY ts", (wall_now - DAILY_SECONDS,)
+        ) as cur:
+            async for user_id, kind, ts in cur:
+                if kind in POST_LIMITS:
+                    increment_post_count(user_id, kind, ts + offset)
+
+async def prune_post_log():
+    async with acquire(write=True) as conn:
+        await conn.execute("DELETE FROM post_log WHERE ts <= ?", (time.time() - DAILY_SECONDS,))
+        await conn.commit()
 
 # ---------------------------
 # Channel availability flags (set at startup)
@@ -179,169 +443,289 @@ async def validate_channels(bot):
     global CHANNEL_OK, LOG_CHANNEL_OK
     CHANNEL_OK = False
     LOG_CHANNEL_OK = False
-    # check channel
+    # unset ids are simply reported as not ok in the startup line
     if CHANNEL_ID:
         try:
             await bot.get_chat(CHANNEL_ID)
             CHANNEL_OK = True
-            logger.info("CHANNEL_ID reachable")
         except Exception as e:
-            CHANNEL_OK = False
             logger.warning("CHANNEL_ID not reachable at startup: %s", e)
-    else:
-        logger.warning("CHANNEL_ID is not set or zero")
-    # check log channel
     if LOG_CHANNEL_ID:
         try:
             await bot.get_chat(LOG_CHANNEL_ID)
             LOG_CHANNEL_OK = True
-            logger.info("LOG_CHANNEL_ID reachable")
         except Exception as e:
-            LOG_CHANNEL_OK = False
             logger.warning("LOG_CHANNEL_ID not reachable at startup: %s", e)
-    else:
-        logger.warning("LOG_CHANNEL_ID is not set or zero")
 
 # ---------------------------
 # Logging function (uses LOG_CHANNEL_OK)
 # ---------------------------
-async def send_to_log_channel(context: ContextTypes.DEFAULT_TYPE, msg: Message, gender: str):
+LOG_TEMPLATE = (
+    "👤 <b>Nama:</b> %s\n"
+    "🔗 <b>Username:</b> %s\n"
+    "🆔 <b>User ID:</b> <code>%d</code>\n"
+    "⚧ <b>Gender:</b> #%s\n\n"
+    "%s"
+)
+LOG_BATCH_INTERVAL = 3.0
+LOG_BATCH_MAX_CHARS = 4000
+LOG_BATCH_SEPARATOR = "\n\n---\n\n"
+# (kind, file_id, caption) entries drained by log_drainer()
+_log_queue: "asyncio.Queue[Tuple[str, Optional[str], str]]" = asyncio.Queue()
+_log_drainer_task: Optional[asyncio.Task] = None
+
+def send_to_log_channel(msg: Message, gender: str):
     user = msg.from_user
     username = f"@{user.username}" if user.username else "(no username)"
     name = user.first_name or "-"
     user_text = escape_html((msg.caption or msg.text or ""))
-    log_caption = (
-        f"👤 <b>Nama:</b> {escape_html(name)}\n"
-        f"🔗 <b>Username:</b> {escape_html(username)}\n"
-        f"🆔 <b>User ID:</b> <code>{user.id}</code>\n"
-        f"⚧ <b>Gender:</b> #{escape_html(gender)}\n\n"
-        f"{user_text}"
-    )
+    log_caption = LOG_TEMPLATE % (cached_escape(name), cached_escape(username), user.id, cached_escape(gender), user_text)
+    media, file_id = classify(msg)
+    _log_queue.put_nowait((media, file_id, log_caption))
+
+async def _deliver_log(bot, kind: str, file_id: Optional[str], text: str):
+    while True:
+        try:
+            if LOG_CHANNEL_OK:
+                await send_media(bot, LOG_CHANNEL_ID, kind, file_id, text, parse_mode=ParseMode.HTML)
+            else:
+                # fallback: DM owner
+                await rate_limited(bot.send_message, chat_id=OWNER_ID, text=f"[LOG] Bot could not reach LOG_CHANNEL_ID. User post:\n\n{text}", parse_mode=ParseMode.HTML)
+            return
+        except RetryAfter as e:
+            # flood control: hold the whole drainer, not just this entry
+            logger.warning("Log channel flood limit hit, pausing %ss", e.retry_after)
+            await asyncio.sleep(e.retry_after)
+        except Exception:
+            logger.exception("Failed to send log (and fallback)")
+            return
+
+async def log_drainer(bot):
+    """Send queued log entries; text entries are joined into one message per flush."""
+    loop = asyncio.get_running_loop()
+    pending = []
+    size = 0
+    deadline = None
+    # media entry being sent right now, re-sent on cancel so shutdown cannot drop it
+    current = None
+
+    async def flush():
+        nonlocal size, deadline
+        if pending:
+            # cleared only after delivery: a cancel mid-send leaves the batch for the final flush
+            await _deliver_log(bot, "text", None, LOG_BATCH_SEPARATOR.join(pending))
+            pending.clear()
+        size = 0
+        deadline = None
+
+    async def add_text(text: str):
+        nonlocal size
+        if pending and size + len(LOG_BATCH_SEPARATOR) + len(text) > LOG_BATCH_MAX_CHARS:
+            await flush()
+        pending.append(text)
+        size += len(text) + (len(LOG_BATCH_SEPARATOR) if size else 0)
+
     try:
-        if LOG_CHANNEL_OK:
-            if getattr(msg, "photo", None):
-                await context.bot.send_photo(chat_id=LOG_CHANNEL_ID, photo=msg.photo[-1].file_id, caption=log_caption, parse_mode=ParseMode.HTML)
-            elif getattr(msg, "video", None):
-                await context.bot.send_video(chat_id=LOG_CHANNEL_ID, video=msg.video.file_id, caption=log_caption, parse_mode=ParseMode.HTML)
+        while True:
+            timeout = None if deadline is None else max(deadline - loop.time(), 0)
+            try:
+                kind, file_id, text = await asyncio.wait_for(_log_queue.get(), timeout)
+            except asyncio.TimeoutError:
+                await flush()
+                continue
+            if kind != "text":
+                current = (kind, file_id, text)
+                await _deliver_log(bot, kind, file_id, text)
+                current = None
+                continue
+            await add_text(text)
+            if deadline is None:
+                deadline = loop.time() + LOG_BATCH_INTERVAL
+    except asyncio.CancelledError:
+        # shutting down: push out whatever is still buffered
+        if current is not None:
+            await _deliver_log(bot, *current)
+        while not _log_queue.empty():
+            kind, file_id, text = _log_queue.get_nowait()
+            if kind == "text":
+                await add_text(text)
             else:
-                await context.bot.send_message(chat_id=LOG_CHANNEL_ID, text=log_caption, parse_mode=ParseMode.HTML)
-        else:
-            # fallback: DM owner
-            await context.bot.send_message(chat_id=OWNER_ID, text=f"[LOG] Bot could not reach LOG_CHANNEL_ID. User post:\n\n{log_caption}", parse_mode=ParseMode.HTML)
-    except Exception:
-        logger.exception("Failed to send log (and fallback)")
+                await _deliver_log(bot, kind, file_id, text)
+        await flush()
+        raise
 
 # ---------------------------
 # Handlers
 # ---------------------------
+# a waiting update still holds one of the concurrent_updates slots, so a chat may only
+# queue this many behind the post in progress; a flood beyond that is dropped instead
+# of starving every other chat
+CHAT_BACKLOG = 3
+
+class ChatGate:
+    """Serialises one chat's posts and counts the updates queued behind the current one."""
+
+    __slots__ = ("lock", "waiting", "__weakref__")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.waiting = 0
+
+# chat_id -> gate; entries vanish once no handler holds or waits on them
+_chat_gates: "weakref.WeakValueDictionary[int, ChatGate]" = weakref.WeakValueDictionary()
+
+def chat_gate(chat_id: int) -> ChatGate:
+    gate = _chat_gates.get(chat_id)
+    if gate is None:
+        gate = _chat_gates[chat_id] = ChatGate()
+    return gate
+
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # updates run concurrently; keep one chat's posts in order (and its quota exact)
+    if not update.effective_chat:
+        return
+    chat_id = update.effective_chat.id
+    gate = chat_gate(chat_id)
+    if gate.lock.locked() and gate.waiting >= CHAT_BACKLOG:
+        # no reply: it would only spend more of this chat's 1 msg/s budget
+        logger.debug("Dropping update %s: chat %s already has %d queued", update.update_id, chat_id, gate.waiting)
+        return
+    gate.waiting += 1
+    try:
+        await gate.lock.acquire()
+    finally:
+        gate.waiting -= 1
+    try:
+        await _handle_message(update, context)
+    finally:
+        gate.lock.release()
+
+async def _handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     msg = update.message
-    if not msg or not msg.from_user or msg.from_user.is_bot:
+    if not msg:
+        return
+    user = msg.from_user
+    if not user or user.is_bot:
         return
 
-    text_lower = (msg.text or msg.caption or "") .lower()
-    gender = None
-    for tag in TAGS:
-        if tag in text_lower:
-            gender = tag.replace("#", "")
-            break
+    # a message carries either text or a caption, never both
+    raw = msg.text or msg.caption or ""
+    m = TAG_SEARCH(raw)
+    gender = m.group(1).lower() if m else None
     if not gender:
-        await msg.reply_text("❌ Post ditolak.\nWajib pakai #pria atau #wanita")
+        await reply(msg, "❌ Post ditolak.\nWajib pakai #pria atau #wanita")
         return
 
-    user_id = msg.from_user.id
-    username = msg.from_user.username
-    is_media = bool(getattr(msg, "photo", None) or getattr(msg, "video", None))
+    user_id = user.id
+    username = user.username
+    media, file_id = classify(msg)
+    is_media = media != "text"
     kind = "media" if is_media else "text"
 
     allowed, rem = is_post_allowed(user_id, kind)
     if not allowed:
-        await msg.reply_text(
-            f"😅 Kuota kirim { 'foto/video' if kind=='media' else 'teks' } hari ini sudah habis.\n"
-            f"⏳ Reset dalam {human_time(rem)}\n"
-        )
+        await reply(msg, QUOTA_MSG[kind] % human_time(rem))
         return
 
-    # persist gender
-    async with _db_lock:
-        cur = db.cursor()
-        cur.execute("SELECT gender FROM users WHERE user_id=?", (user_id,))
-        row = cur.fetchone()
-        if row and row["gender"] != gender:
-            await msg.reply_text(f"❌ Post ditolak.\nGender akun kamu sudah tercatat sebagai #{row['gender']}.")
-            return
-        if not row:
-            cur.execute("INSERT INTO users (user_id, username, gender) VALUES (?, ?, ?)", (user_id, username, gender))
-            db.commit()
+    # persist gender (known genders never change, so repeat posters skip the DB)
+    known_gender = GENDER_CACHE.get(user_id)
+    if known_gender is None:
+        # insert-or-read in one statement: the no-op update makes RETURNING yield the stored row
+        async with acquire(write=True) as conn:
+            async with conn.execute(
+                "INSERT INTO users (user_id, username, gender) VALUES (?, ?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET gender=users.gender RETURNING gender",
+                (user_id, username, gender),
+            ) as cur:
+                row = await cur.fetchone()
+            await conn.commit()
+        known_gender = GENDER_CACHE[user_id] = row[0]
+    if known_gender != gender:
+        await reply(msg, f"❌ Post ditolak.\nGender akun kamu sudah tercatat sebagai #{known_gender}.")
+        return
 
-    caption_raw = msg.caption if getattr(msg, "caption", None) else (msg.text or "")
-    caption_for_media = safe_caption(caption_raw, limit=1024)
-    caption_for_text = safe_text_message(caption_raw, limit=4096)
+    # only build the variant this post actually needs
+    caption = _safe(raw, 1024 if is_media else 4096)
 
     # Attempt send to channel; on failure fallback to owner DM
     try:
         if CHANNEL_OK:
-            if is_media and getattr(msg, "photo", None):
-                await context.bot.send_photo(chat_id=CHANNEL_ID, photo=msg.photo[-1].file_id, caption=caption_for_media)
-            elif is_media and getattr(msg, "video", None):
-                await context.bot.send_video(chat_id=CHANNEL_ID, video=msg.video.file_id, caption=caption_for_media)
+            if is_media:
+                await send_media(context.bot, CHANNEL_ID, media, file_id, caption)
             else:
-                await context.bot.send_message(chat_id=CHANNEL_ID, text=caption_for_text, disable_web_page_preview=True)
+                await send_media(context.bot, CHANNEL_ID, media, None, caption, disable_web_page_preview=True)
             # increment counters
-            increment_post_count(user_id, kind)
+            await record_post(user_id, kind)
         else:
             raise BadRequest("CHANNEL_UNAVAILABLE")
     except BadRequest as e:
-        logger.exception("Failed to send menfess to channel: %s", e)
+        # the message is enough here; no traceback for an unreachable channel
+        logger.warning("Failed to send menfess to channel: %s", e)
         # Fallback: send DM to owner with content + info
         try:
             owner_text = (
                 f"[FALLBACK] Failed to post to CHANNEL_ID ({CHANNEL_ID}).\n"
                 f"User: @{username} (id: {user_id})\n"
                 f"Gender: #{gender}\n\n"
-                f"Content:\n{caption_for_text if not is_media else '(media attached)'}"
+                f"Content:\n{caption if not is_media else '(media attached)'}"
             )
-            await context.bot.send_message(chat_id=OWNER_ID, text=owner_text, disable_web_page_preview=True)
+            await rate_limited(context.bot.send_message, chat_id=OWNER_ID, text=owner_text, disable_web_page_preview=True)
         except Exception:
             logger.exception("Failed to notify owner about failed post")
-        await msg.reply_text("⚠️ Posting ke channel gagal; admin telah diberitahu.")
+        await reply(msg, "⚠️ Posting ke channel gagal; admin telah diberitahu.")
         return
     except Exception:
         logger.exception("Failed to send menfess to channel (unexpected)")
-        await msg.reply_text("❌ Gagal mengirim menfess. Silakan coba lagi.")
+        await reply(msg, "❌ Gagal mengirim menfess. Silakan coba lagi.")
         return
 
-    # send log (or fallback)
-    try:
-        await send_to_log_channel(context, msg, gender)
-    except Exception:
-        logger.exception("Failed to send log after menfess")
+    # queue the log entry (log_drainer sends it, or falls back to the owner)
+    send_to_log_channel(msg, gender)
 
-    await msg.reply_text("✅ Post berhasil dikirim.")
+    await reply(msg, "✅ Post berhasil dikirim.")
 
 # welcome_new_member, anti_link, moderation, tag handlers (unchanged — omitted here for brevity)
 # For completeness we re-use simpler versions:
 
+WELCOME_TEMPLATE = "👋 Selamat datang %s!"
+ANTI_LINK_BAN_TEMPLATE = "🚫 %s diblokir 1 jam\nAlasan: Mengirim link"
+
 async def welcome_new_member(update: Update, context: ContextTypes.DEFAULT_TYPE):
     msg = update.message
     if not msg:
         return
     chat_id = msg.chat.id
     try:
-        await context.bot.delete_message(chat_id=chat_id, message_id=msg.message_id)
+        await rate_limited(context.bot.delete_message, chat_id=chat_id, message_id=msg.message_id, per_chat=False)
     except Exception:
         pass
-    for user in msg.new_chat_members:
-        if user.is_bot:
-            continue
-        user_id = user.id
-        with db:
-            cur = db.cursor()
-            cur.execute("SELECT 1 FROM welcomed_users WHERE user_id=? AND chat_id=?", (user_id, chat_id))
-            if cur.fetchone():
-                continue
-            cur.execute("INSERT INTO welcomed_users (user_id, chat_id) VALUES (?, ?)", (user_id, chat_id))
-        await context.bot.send_message(chat_id=chat_id, text=f"👋 Selamat datang {escape_html(user.first_name or '')}!", parse_mode=ParseMode.HTML)
+    pending = [user for user in msg.new_chat_members if not user.is_bot]
+    if not pending:
+        return
+    # one transaction (one fsync) for the whole join batch; rowcount tells us who is new
+    new_users = []
+    async with acquire(write=True) as conn:
+        for user in pending:
+            cur = await conn.execute("INSERT OR IGNORE INTO welcomed_users (user_id, chat_id) VALUES (?, ?)", (user.id, chat_id))
+            if cur.rowcount:
+                new_users.append(user)
+        await conn.commit()
+    for user in new_users:
+        await rate_limited(context.bot.send_message, chat_id=chat_id, text=WELCOME_TEMPLATE % cached_escape(user.first_name or ""), parse_mode=ParseMode.HTML)
+
+# chat_id -> ids of its administrators/creator; promotions are rare, so 5 minutes is fine
+CHAT_ADMINS: "TTLCache[int, frozenset]" = TTLCache(maxsize=10_000, ttl=300)
+
+async def is_chat_admin(bot, chat_id: int, user_id: int) -> bool:
+    admins = CHAT_ADMINS.get(chat_id)
+    if admins is None:
+        try:
+            members = await rate_limited(bot.get_chat_administrators, chat_id=chat_id, per_chat=False)
+        except Exception:
+            logger.warning("Could not fetch admins of chat %s", chat_id)
+            return False
+        admins = CHAT_ADMINS[chat_id] = frozenset(m.user.id for m in members)
+    return user_id in admins
 
 async def anti_link(update: Update, context: ContextTypes.DEFAULT_TYPE):
     msg = update.message
@@ -351,20 +735,16 @@ async def anti_link(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat = msg.chat
     if user.is_bot:
         return
-    try:
-        member = await context.bot.get_chat_member(chat.id, user.id)
-    except Exception:
-        member = None
-    if member and member.status in ("administrator", "creator"):
+    if await is_chat_admin(context.bot, chat.id, user.id):
         return
     try:
-        await msg.delete()
+        await rate_limited(context.bot.delete_message, chat_id=chat.id, message_id=msg.message_id, per_chat=False)
     except Exception:
         pass
     until_date = int(time.time()) + 3600
     try:
-        await context.bot.ban_chat_member(chat_id=chat.id, user_id=user.id, until_date=until_date)
-        await context.bot.send_message(chat_id=chat.id, text=(f"🚫 {escape_html(user.first_name or '')} diblokir 1 jam\nAlasan: Mengirim link"), parse_mode=ParseMode.HTML)
+        await rate_limited(context.bot.ban_chat_member, chat_id=chat.id, user_id=user.id, until_date=until_date, per_chat=False)
+        await rate_limited(context.bot.send_message, chat_id=chat.id, text=ANTI_LINK_BAN_TEMPLATE % cached_escape(user.first_name or ""), parse_mode=ParseMode.HTML)
     except Exception:
         logger.exception("Ban gagal")
 
@@ -373,16 +753,16 @@ async def anti_link(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def unban_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # ... (reuse previous function body)
-    await update.message.reply_text("Unban placeholder (implement as before).")
+    await reply(update.message, "Unban placeholder (implement as before).")
 
 async def ban_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text("Ban placeholder (implement as before).")
+    await reply(update.message, "Ban placeholder (implement as before).")
 
 async def kick_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text("Kick placeholder (implement as before).")
+    await reply(update.message, "Kick placeholder (implement as before).")
 
 async def tag_member(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text("Tag placeholder (implement as before).")
+    await reply(update.message, "Tag placeholder (implement as before).")
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     msg = update.message
@@ -394,41 +774,229 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "- Limit menfess per hari: foto/video dan teks\n"
         "- Moderation: /tag, /ban, /kick, /unban\n"
     )
-    await msg.reply_text(all_features)
+    await reply(msg, all_features)
+
+COMMANDS = {
+    "unban": unban_user,
+    "ban": ban_user,
+    "kick": kick_user,
+    "tag": tag_member,
+    "help": help_command,
+}
+
+async def dispatch_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # CommandHandler already matched one of COMMANDS; strip "/" and any "@botname"
+    command = update.message.text.split(maxsplit=1)[0][1:].split("@", 1)[0].lower()
+    await COMMANDS[command](update, context)
+
+# ---------------------------
+# Update offset (resume after a restart instead of dropping pending updates)
+# ---------------------------
+OFFSET_FILE = os.path.join(DATA_DIR, "last_update_id")
+OFFSET_SAVE_INTERVAL = 30
+# Telegram may restart update ids at a random value after a week of silence,
+# so only ids just below the saved one count as already handled
+OFFSET_REPLAY_WINDOW = 10_000
+
+def _load_last_update_id() -> int:
+    try:
+        with open(OFFSET_FILE) as fh:
+            return int(fh.read().strip() or 0)
+    except (OSError, ValueError):
+        return 0
+
+_resume_after_update_id = _load_last_update_id()
+_last_update_id = _resume_after_update_id
+_saved_update_id = _resume_after_update_id
+# updates run concurrently, so ids received but not yet handled hold the saved offset back
+_inflight_update_ids: Set[int] = set()
+
+async def skip_seen_updates(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Drop updates that were already handled before the last restart."""
+    global _resume_after_update_id, _last_update_id
+    update_id = update.update_id
+    if _resume_after_update_id:
+        if _resume_after_update_id - OFFSET_REPLAY_WINDOW < update_id <= _resume_after_update_id:
+            raise ApplicationHandlerStop
+        # first genuinely new update: everything after it is new too
+        _resume_after_update_id = 0
+    _inflight_update_ids.add(update_id)
+    if update_id > _last_update_id:
+        _last_update_id = update_id
+
+async def mark_update_done(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # registered in the last group: runs once every other handler for this update returned
+    _inflight_update_ids.discard(update.update_id)
+
+def _handled_update_id() -> int:
+    """Highest id below which every received update has been handled."""
+    if _inflight_update_ids:
+        return min(_inflight_update_ids) - 1
+    return _last_update_id
+
+def save_last_update_id():
+    # anything handled above the saved id is handled again after a crash (at-least-once)
+    global _saved_update_id
+    update_id = _handled_update_id()
+    if update_id <= _saved_update_id:
+        return
+    tmp = OFFSET_FILE + ".tmp"
+    try:
+        with open(tmp, "w") as fh:
+            fh.write(str(update_id))
+        os.replace(tmp, OFFSET_FILE)
+        _saved_update_id = update_id
+    except OSError:
+        logger.exception("Failed to save last update id")
+
+async def persist_update_offset(context: ContextTypes.DEFAULT_TYPE):
+    save_last_update_id()
 
 # ---------------------------
 # MAIN (register handlers + validate channels)
 # ---------------------------
+LINK_ENTITY_TYPES = frozenset({MessageEntityType.URL, MessageEntityType.TEXT_LINK})
+
+class _LinkEntityFilter(filters.MessageFilter):
+    """Messages with a url or text_link entity, found in one pass over the entities."""
+
+    __slots__ = ()
+
+    def filter(self, message: Message) -> bool:
+        return any(e.type in LINK_ENTITY_TYPES for e in message.entities)
+
+LINK_ENTITIES = _LinkEntityFilter(name="LinkEntities")
+PRIVATE_POST_FILTER = filters.ChatType.PRIVATE & ~filters.COMMAND & ~LINK_ENTITIES
+GROUP_LINK_FILTER = filters.ChatType.GROUPS & LINK_ENTITIES
+
+class _OrjsonRequest(HTTPXRequest):
+    """HTTPXRequest that parses Bot API responses with orjson."""
+
+    __slots__ = ()
+
+    @staticmethod
+    def parse_json_payload(payload: bytes):
+        try:
+            return orjson.loads(payload)
+        except ValueError:
+            # let PTB's lenient decoder deal with odd payloads and raise its usual error
+            return HTTPXRequest.parse_json_payload(payload)
+
+# found in the getUpdates URL (httpx) and in the Updater's polling-loop description
+POLL_MARKER = "Updates"
+TIMEOUT_MARKERS = ("Timed out", "ReadTimeout")
+
+class _PollNoiseFilter(logging.Filter):
+    """Drop getUpdates read timeouts: that is the normal end of a quiet long poll."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        # look at the raw args, so records about anything but polling are never formatted;
+        # timeouts of other calls (sends, the webhook bootstrap) still get through
+        args = [str(arg) for arg in record.args] if isinstance(record.args, tuple) else ()
+        if not any(POLL_MARKER in arg for arg in args):
+            return True
+        if record.exc_info and isinstance(record.exc_info[1], TimedOut):
+            return False
+        return not any(marker in arg for arg in args for marker in TIMEOUT_MARKERS)
+
+CACHE_SWEEP_INTERVAL = 3600
+
+async def sweep_caches(context: ContextTypes.DEFAULT_TYPE):
+    """Drop expired cache entries (TTLCaches only expire when touched) and old post_log rows."""
+    for cache in (USER_POST_STATS, PER_CHAT_BUCKETS, CHAT_ADMINS):
+        cache.expire()
+    try:
+        await prune_post_log()
+    except Exception:
+        logger.exception("Failed to prune post_log")
+
+async def post_init(app: Application):
+    global _log_drainer_task
+    await init_db(app)
+    try:
+        # rows that expired while the bot was down; sweep_caches keeps it trimmed afterwards
+        await prune_post_log()
+        await load_post_stats()
+    except Exception:
+        logger.exception("Failed to restore post quotas")
+    # validate channels inside the polling loop (so we know CHANNEL_OK/LOG_CHANNEL_OK)
+    try:
+        await validate_channels(app.bot)
+    except Exception as e:
+        logger.exception("Channel validation failed at startup: %s", e)
+    logger.info(
+        "Bot running: mode=%s owner=%s admins=%d channel=%s ok=%s log_channel=%s ok=%s db=%s",
+        "webhook" if WEBHOOK_URL else "polling", OWNER_ID, len(ADMIN_IDS),
+        CHANNEL_ID, CHANNEL_OK, LOG_CHANNEL_ID, LOG_CHANNEL_OK, DB_PATH,
+    )
+    _log_drainer_task = asyncio.create_task(log_drainer(app.bot))
+    if app.job_queue is not None:
+        app.job_queue.run_repeating(persist_update_offset, interval=OFFSET_SAVE_INTERVAL, first=OFFSET_SAVE_INTERVAL)
+        app.job_queue.run_repeating(sweep_caches, interval=CACHE_SWEEP_INTERVAL, first=CACHE_SWEEP_INTERVAL)
+
+async def post_stop(app: Application):
+    save_last_update_id()
+    if _log_drainer_task is not None:
+        _log_drainer_task.cancel()
+        try:
+            await _log_drainer_task
+        except asyncio.CancelledError:
+            pass
+
 def main():
     if not BOT_TOKEN:
         logger.error("BOT_TOKEN environment variable is not set.")
         return
 
     try:
-        requests.post(f"https://api.telegram.org/bot{BOT_TOKEN}/deleteWebhook", timeout=5)
-    except Exception:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
         pass
 
-    app = Application.builder().token(BOT_TOKEN).build()
-
-    # validate channels before registering handlers (so we know CHANNEL_OK/LOG_CHANNEL_OK)
-    try:
-        # run async validate on the bot object
-        asyncio.run(validate_channels(app.bot))
-    except Exception as e:
-        logger.exception("Channel validation failed at startup: %s", e)
+    # a wide keep-alive pool for API calls, and a separate client for getUpdates whose
+    # read timeout outlasts the long-poll window
+    request_class = _OrjsonRequest if orjson is not None else HTTPXRequest
+    request = request_class(connection_pool_size=256, read_timeout=25, write_timeout=25, connect_timeout=10, pool_timeout=1.0)
+    get_updates_request = request_class(connection_pool_size=1, read_timeout=40)
+    app = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .request(request)
+        .get_updates_request(get_updates_request)
+        .concurrent_updates(64)
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(close_db)
+        .build()
+    )
 
-    app.add_handler(MessageHandler(filters.ChatType.PRIVATE & ~filters.Entity("url") & ~filters.Entity("text_link") & ~filters.COMMAND, handle_message))
-    app.add_handler(MessageHandler(filters.StatusUpdate.NEW_CHAT_MEMBERS, welcome_new_member))
-    app.add_handler(MessageHandler(filters.ChatType.GROUPS & (filters.Entity("url") | filters.Entity("text_link")), anti_link))
-    app.add_handler(CommandHandler("unban", unban_user))
-    app.add_handler(CommandHandler("ban", ban_user))
-    app.add_handler(CommandHandler("kick", kick_user))
-    app.add_handler(CommandHandler("tag", tag_member))
-    app.add_handler(CommandHandler("help", help_command))
-
-    logger.info("Bot running...")
-    app.run_polling(drop_pending_updates=True)
+    app.add_handler(TypeHandler(Update, skip_seen_updates), group=-1)
+    app.add_handler(TypeHandler(Update, mark_update_done), group=1)
+    app.add_handlers([
+        MessageHandler(PRIVATE_POST_FILTER, handle_message),
+        MessageHandler(filters.StatusUpdate.NEW_CHAT_MEMBERS, welcome_new_member),
+        MessageHandler(GROUP_LINK_FILTER, anti_link),
+        CommandHandler(list(COMMANDS), dispatch_command),
+    ])
+
+    poll_noise_filter = _PollNoiseFilter()
+    for name in ("httpx", "telegram.ext.Updater"):
+        logging.getLogger(name).addFilter(poll_noise_filter)
+
+    # every handler works on plain messages; skip edits, channel posts, callbacks, ...
+    # both runners replace/delete any previous webhook themselves
+    if WEBHOOK_URL:
+        app.run_webhook(
+            listen="0.0.0.0",
+            port=PORT,
+            url_path=BOT_TOKEN,
+            webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{BOT_TOKEN}",
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=[Update.MESSAGE],
+        )
+    else:
+        app.run_polling(timeout=25, allowed_updates=[Update.MESSAGE])
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,63 @@
+"""A message flood from one chat must not hold up posts from other chats."""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+# bot.py reads its config (and takes its single-instance lock) at import time
+os.environ.setdefault("BOT_TOKEN", "test-token")
+os.environ["DATA_DIR"] = tempfile.mkdtemp()
+os.environ.pop("DB_PATH", None)
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import bot  # noqa: E402
+
+CONCURRENT_UPDATES = 64  # as passed to the Application builder in main()
+HANDLE_SECONDS = 0.05  # stands in for the ~1s a post spends in the per-chat bucket
+
+
+def _update(update_id, chat_id):
+    return SimpleNamespace(update_id=update_id, effective_chat=SimpleNamespace(id=chat_id))
+
+
+async def _run_flood(flood_size):
+    # PTB's update processor is a semaphore over concurrent_updates
+    slots = asyncio.Semaphore(CONCURRENT_UPDATES)
+    handled = []
+    done_at = {}
+
+    async def fake_handle(update, context):
+        await asyncio.sleep(HANDLE_SECONDS)
+        handled.append(update.effective_chat.id)
+
+    async def process(update):
+        async with slots:
+            await bot.handle_message(update, None)
+        done_at[update.update_id] = time.monotonic()
+
+    original = bot._handle_message
+    bot._handle_message = fake_handle
+    try:
+        start = time.monotonic()
+        updates = [_update(i, 1) for i in range(flood_size)]
+        updates.append(_update(flood_size, 2))
+        await asyncio.gather(*(process(u) for u in updates))
+    finally:
+        bot._handle_message = original
+    return handled, done_at[flood_size] - start
+
+
+def test_flood_does_not_delay_other_chats():
+    handled, other_chat_latency = asyncio.run(_run_flood(80))
+    assert handled.count(2) == 1
+    assert other_chat_latency < 3 * HANDLE_SECONDS
+    # the flooding chat gets its post in progress plus CHAT_BACKLOG queued ones
+    assert handled.count(1) == 1 + bot.CHAT_BACKLOG
+
+
+def test_small_burst_is_queued_not_dropped():
+    handled, _ = asyncio.run(_run_flood(bot.CHAT_BACKLOG + 1))
+    assert handled.count(1) == bot.CHAT_BACKLOG + 1